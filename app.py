@@ -1,14 +1,64 @@
+import io
+import json
+import threading
 import uvicorn
-from fastapi import FastAPI, Depends, HTTPException
+from decouple import config, Csv
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-from models import get_db, User, Category, Product, Order, OrderItems
+from models import get_db, User, Category, Product, ProductPriceHistory, Order, OrderItems, CatalogVersion, ProductDeletion
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, update, and_
+from models import Session as SessionLocal
+from scheduler import scheduler
+from ratelimit import RateLimiter, RateLimitMiddleware
+
+# optional encoders for the catalog snapshot endpoint
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # maintenance jobs run on the scheduler's own thread pool
+    scheduler.start()
+    try:
+        yield
+    finally:
+        scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Rate limits per API key/IP; routes that scan whole tables cost more and
+# at most 4 of them (cost >= heavy_cost) run at once. Only the integration
+# keys listed in RATE_LIMIT_API_KEYS get a bucket of their own.
+rate_limiter = RateLimiter(
+    api_keys=config("RATE_LIMIT_API_KEYS", default="", cast=Csv()),
+    rate=10.0,
+    burst=30.0,
+    route_costs={
+        ("GET", "/orders"): 10,
+        ("GET", "/products"): 5,
+        ("GET", "/products/snapshot"): 5,
+        ("GET", "/users"): 3,
+        ("GET", "/categories"): 2,
+    },
+    heavy_cost=5,
+    max_heavy_in_flight=4,
+)
 
-app = FastAPI()
+# added before CORS so rejections still carry the CORS headers
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 
 # CORS configuration
 origins = [
@@ -103,13 +153,37 @@ def delete_user(user_id: int, session: Session = Depends(get_db)):
 class CategoryCreate(BaseModel):
     name: str
     description: Optional[str] = None
+    parent_id: Optional[int] = None
 
 class CategoryResponse(BaseModel):
     id: int
     name: str
     description: Optional[str]
+    parent_id: Optional[int] = None
     products_count: Optional[int] = 0
 
+def path_ids(path: str) -> List[int]:
+    return [int(part) for part in path.strip("/").split("/") if part]
+
+def subtree_filter(path: str):
+    # "/1/" <= path < "/10" matches exactly the paths under "/1/" ("0" sorts
+    # right after "/"), so the subtree is a range scan on the path index
+    return and_(Category.path >= path, Category.path < path[:-1] + "0")
+
+def adjust_category_aggregates(session: Session, category_id: int, count_delta: int, value_delta: int):
+    """Apply a product count/stock value change to a category and all of its ancestors."""
+    if not count_delta and not value_delta:
+        return
+    path = session.query(Category.path).filter(Category.id == category_id).scalar()
+    session.query(Category).filter(Category.id == category_id).update({
+        Category.product_count: Category.product_count + count_delta,
+        Category.stock_value: Category.stock_value + value_delta
+    }, synchronize_session=False)
+    session.query(Category).filter(Category.id.in_(path_ids(path))).update({
+        Category.subtree_product_count: Category.subtree_product_count + count_delta,
+        Category.subtree_stock_value: Category.subtree_stock_value + value_delta
+    }, synchronize_session=False)
+
 @app.get("/categories")
 def get_categories(session: Session = Depends(get_db)):
     categories = session.query(Category).all()
@@ -121,25 +195,72 @@ def get_category(category_id: int, session: Session = Depends(get_db)):
     if category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     
-    # Get products count
-    products_count = session.query(func.count(Product.id)).filter(
-        Product.category_id == category_id
-    ).scalar()
-    
     return {
         "id": category.id,
         "name": category.name,
         "description": category.description,
-        "products_count": products_count
+        "parent_id": category.parent_id,
+        "path": category.path,
+        "products_count": category.product_count,
+        "stock_value": category.stock_value,
+        "subtree_products_count": category.subtree_product_count,
+        "subtree_stock_value": category.subtree_stock_value
     }
 
+@app.get("/categories/{category_id}/subtree")
+def get_category_subtree(category_id: int, session: Session = Depends(get_db)):
+    path = session.query(Category.path).filter(Category.id == category_id).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    categories = session.query(Category).filter(subtree_filter(path)).order_by(Category.path).all()
+    return categories
+
+@app.get("/categories/{category_id}/products")
+def get_category_products(category_id: int, session: Session = Depends(get_db)):
+    path = session.query(Category.path).filter(Category.id == category_id).scalar()
+    if path is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    # All products anywhere under this category
+    products = session.query(
+        Product.id,
+        Product.name,
+        Product.price,
+        Product.quantity,
+        Product.category_id,
+        Category.name.label("category_name")
+    ).join(Category, Product.category_id == Category.id).filter(
+        subtree_filter(path)
+    ).all()
+    
+    return [{
+        "id": p.id,
+        "name": p.name,
+        "price": p.price,
+        "quantity": p.quantity,
+        "category_id": p.category_id,
+        "category_name": p.category_name
+    } for p in products]
+
 @app.post("/categories")
 def create_category(category: CategoryCreate, session: Session = Depends(get_db)):
+    parent_path = "/"
+    if category.parent_id is not None:
+        parent = session.query(Category).filter(Category.id == category.parent_id).first()
+        if parent is None:
+            raise HTTPException(status_code=404, detail="Parent category not found")
+        parent_path = parent.path
+    
     new_category = Category(
         name=category.name,
-        description=category.description
+        description=category.description,
+        parent_id=category.parent_id
     )
     session.add(new_category)
+    session.flush()  # Get the category ID without committing
+    new_category.path = f"{parent_path}{new_category.id}/"
+    
     session.commit()
     session.refresh(new_category)
     return {"message": "Category created successfully", "category": new_category}
@@ -150,6 +271,48 @@ def update_category(category_id: int, category: CategoryCreate, session: Session
     if existing_category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     
+    # Only move the category when the client sent parent_id explicitly
+    if "parent_id" in category.model_fields_set and category.parent_id != existing_category.parent_id:
+        parent_path = "/"
+        if category.parent_id is not None:
+            parent = session.query(Category).filter(Category.id == category.parent_id).first()
+            if parent is None:
+                raise HTTPException(status_code=404, detail="Parent category not found")
+            if parent.path.startswith(existing_category.path):
+                raise HTTPException(status_code=400, detail="Cannot move a category under itself")
+            parent_path = parent.path
+        
+        old_path = existing_category.path
+        new_path = f"{parent_path}{category_id}/"
+        count = existing_category.subtree_product_count
+        value = existing_category.subtree_stock_value
+        
+        # Take the subtree totals off the old ancestors
+        session.query(Category).filter(Category.id.in_(path_ids(old_path)[:-1])).update({
+            Category.subtree_product_count: Category.subtree_product_count - count,
+            Category.subtree_stock_value: Category.subtree_stock_value - value
+        }, synchronize_session=False)
+        
+        # Rewrite the path prefix of the whole subtree
+        session.query(Category).filter(subtree_filter(old_path)).update({
+            Category.path: new_path + func.substr(Category.path, len(old_path) + 1)
+        }, synchronize_session=False)
+        
+        # And add them to the new ancestors
+        session.query(Category).filter(Category.id.in_(path_ids(new_path)[:-1])).update({
+            Category.subtree_product_count: Category.subtree_product_count + count,
+            Category.subtree_stock_value: Category.subtree_stock_value + value
+        }, synchronize_session=False)
+        
+        existing_category.parent_id = category.parent_id
+    
+    if existing_category.name != category.name:
+        # category_name is part of the catalog snapshot, so stamp its products
+        version = bump_catalog_version(session)
+        session.query(Product).filter(Product.category_id == category_id).update(
+            {Product.version: version}, synchronize_session=False
+        )
+
     existing_category.name = category.name
     existing_category.description = category.description
     
@@ -164,13 +327,14 @@ def delete_category(category_id: int, session: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Category not found")
     
     # Check if category has products
-    products_count = session.query(func.count(Product.id)).filter(
-        Product.category_id == category_id
-    ).scalar()
-    
-    if products_count > 0:
+    if existing_category.product_count > 0:
         raise HTTPException(status_code=400, detail="Cannot delete category with existing products")
     
+    # Check if category has subcategories
+    has_children = session.query(Category.id).filter(Category.parent_id == category_id).first()
+    if has_children is not None:
+        raise HTTPException(status_code=400, detail="Cannot delete category with subcategories")
+    
     session.delete(existing_category)
     session.commit()
     return {"message": "Category deleted successfully"}
@@ -196,6 +360,68 @@ class ProductResponse(BaseModel):
     category_id: int
     category_name: Optional[str] = None
 
+SNAPSHOT_COLUMNS = ["id", "name", "price", "quantity", "category_id", "category_name"]
+
+SNAPSHOT_MEDIA_TYPES = {
+    "json": "application/json",
+    "msgpack": "application/x-msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+# encoded full snapshot bodies per format, for the current catalog version only
+_snapshot_cache = {"version": None, "bodies": {}}
+_snapshot_cache_lock = threading.Lock()
+
+def get_catalog_version(session: Session) -> int:
+    version = session.query(CatalogVersion.version).filter(CatalogVersion.id == 1).scalar()
+    return version or 0
+
+def bump_catalog_version(session: Session) -> int:
+    """Increment the catalog version inside the caller's transaction and return it."""
+    # The UPDATE runs first so it takes SQLite's write lock before the read;
+    # a read-modify-write in Python lets two writers share one version
+    bumped = session.execute(
+        update(CatalogVersion).where(CatalogVersion.id == 1).values(version=CatalogVersion.version + 1)
+    )
+    if bumped.rowcount == 0:
+        session.add(CatalogVersion(id=1, version=1))
+        session.flush()
+        return 1
+    return session.execute(select(CatalogVersion.version).where(CatalogVersion.id == 1)).scalar_one()
+
+def encode_snapshot(fmt: str, version: int, since_version: Optional[int], columns: list, deleted: list) -> bytes:
+    if fmt == "arrow":
+        table = pyarrow.table(
+            dict(zip(SNAPSHOT_COLUMNS, columns)),
+            schema=pyarrow.schema([
+                ("id", pyarrow.int64()),
+                ("name", pyarrow.string()),
+                ("price", pyarrow.int64()),
+                ("quantity", pyarrow.int64()),
+                ("category_id", pyarrow.int64()),
+                ("category_name", pyarrow.string()),
+            ], metadata={
+                "version": str(version),
+                "since_version": "" if since_version is None else str(since_version),
+                "deleted": json.dumps(deleted),
+            })
+        )
+        sink = io.BytesIO()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue()
+
+    payload = {
+        "version": version,
+        "since_version": since_version,
+        "columns": SNAPSHOT_COLUMNS,
+        "data": dict(zip(SNAPSHOT_COLUMNS, columns)),
+        "deleted": deleted,
+    }
+    if fmt == "msgpack":
+        return msgpack.packb(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
 @app.get("/products")
 def get_products(session: Session = Depends(get_db)):
     products = session.query(
@@ -216,6 +442,63 @@ def get_products(session: Session = Depends(get_db)):
         "category_name": p.category_name
     } for p in products]
 
+@app.get("/products/snapshot")
+def get_products_snapshot(since_version: Optional[int] = None, fmt: str = Query("json", alias="format"), session: Session = Depends(get_db)):
+    if fmt not in SNAPSHOT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {fmt}")
+    if fmt == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=406, detail="msgpack is not installed on the server")
+    if fmt == "arrow" and pyarrow is None:
+        raise HTTPException(status_code=406, detail="pyarrow is not installed on the server")
+
+    version = get_catalog_version(session)
+    if since_version is not None and since_version < 0:
+        # nothing predates version 0, so this is a full snapshot
+        since_version = None
+    if since_version is not None and since_version >= version:
+        since_version = version
+
+    # Only full snapshots are cached; deltas are small and their keys unbounded
+    body = None
+    if since_version is None:
+        with _snapshot_cache_lock:
+            if _snapshot_cache["version"] != version:
+                _snapshot_cache["version"] = version
+                _snapshot_cache["bodies"] = {}
+            body = _snapshot_cache["bodies"].get(fmt)
+
+    if body is None:
+        query = select(
+            Product.id,
+            Product.name,
+            Product.price,
+            Product.quantity,
+            Product.category_id,
+            Category.name
+        ).join(Category, Product.category_id == Category.id).order_by(Product.id)
+        deleted = []
+        if since_version is not None:
+            query = query.where(Product.version > since_version)
+            deleted = session.execute(
+                select(ProductDeletion.product_id).where(ProductDeletion.version > since_version)
+            ).scalars().all()
+
+        # Transpose the row tuples straight into columns
+        rows = session.execute(query).all()
+        columns = [list(col) for col in zip(*rows)] if rows else [[] for _ in SNAPSHOT_COLUMNS]
+
+        body = encode_snapshot(fmt, version, since_version, columns, deleted)
+        if since_version is None:
+            with _snapshot_cache_lock:
+                if _snapshot_cache["version"] == version:
+                    _snapshot_cache["bodies"][fmt] = body
+
+    return Response(
+        content=body,
+        media_type=SNAPSHOT_MEDIA_TYPES[fmt],
+        headers={"X-Catalog-Version": str(version)}
+    )
+
 @app.get("/products/{product_id}")
 def get_product(product_id: int, session: Session = Depends(get_db)):
     product = session.query(
@@ -252,10 +535,22 @@ def create_product(product: ProductCreate, session: Session = Depends(get_db)):
         name=product.name,
         price=product.price,
         quantity=product.quantity,
-        category_id=product.category_id
+        category_id=product.category_id,
+        version=bump_catalog_version(session)
     )
     
     session.add(new_product)
+    session.flush()  # Get the product ID without committing
+
+    adjust_category_aggregates(session, new_product.category_id, 1, new_product.price * new_product.quantity)
+
+    # Open the first price history range
+    session.add(ProductPriceHistory(
+        product_id=new_product.id,
+        price=new_product.price,
+        valid_from=datetime.now()
+    ))
+
     session.commit()
     session.refresh(new_product)
     return {"message": "Product created successfully", "product": new_product}
@@ -266,10 +561,24 @@ def update_product(product_id: int, product_update: ProductUpdate, session: Sess
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    old_category_id = product.category_id
+    old_value = product.price * product.quantity
+    
     # Update fields if provided
     if product_update.name is not None:
         product.name = product_update.name
-    if product_update.price is not None:
+    if product_update.price is not None and product_update.price != product.price:
+        # Close the current price range and open a new one
+        now = datetime.now()
+        session.query(ProductPriceHistory).filter(
+            ProductPriceHistory.product_id == product_id,
+            ProductPriceHistory.valid_to.is_(None)
+        ).update({ProductPriceHistory.valid_to: now}, synchronize_session=False)
+        session.add(ProductPriceHistory(
+            product_id=product_id,
+            price=product_update.price,
+            valid_from=now
+        ))
         product.price = product_update.price
     if product_update.quantity is not None:
         product.quantity = product_update.quantity
@@ -280,16 +589,66 @@ def update_product(product_id: int, product_update: ProductUpdate, session: Sess
             raise HTTPException(status_code=404, detail="Category not found")
         product.category_id = product_update.category_id
     
+    new_value = product.price * product.quantity
+    if product.category_id == old_category_id:
+        adjust_category_aggregates(session, old_category_id, 0, new_value - old_value)
+    else:
+        adjust_category_aggregates(session, old_category_id, -1, -old_value)
+        adjust_category_aggregates(session, product.category_id, 1, new_value)
+    
+    product.version = bump_catalog_version(session)
     session.commit()
     session.refresh(product)
     return {"message": "Product updated successfully", "product": product}
 
+@app.get("/products/{product_id}/prices")
+def get_product_prices(product_id: int, at: Optional[datetime] = None, session: Session = Depends(get_db)):
+    product = session.query(Product.id).filter(Product.id == product_id).first()
+    if product is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    query = session.query(
+        ProductPriceHistory.price,
+        ProductPriceHistory.valid_from,
+        ProductPriceHistory.valid_to
+    ).filter(ProductPriceHistory.product_id == product_id)
+
+    if at is not None:
+        # History is stored as naive local time, like the rest of the app
+        if at.tzinfo is not None:
+            at = at.astimezone().replace(tzinfo=None)
+
+        # Point-in-time lookup served by the (product_id, valid_from) index
+        entry = query.filter(
+            ProductPriceHistory.valid_from <= at
+        ).order_by(ProductPriceHistory.valid_from.desc()).first()
+        if entry is None or (entry.valid_to is not None and entry.valid_to <= at):
+            raise HTTPException(status_code=404, detail="No price recorded at that time")
+        return {
+            "product_id": product_id,
+            "price": entry.price,
+            "valid_from": entry.valid_from,
+            "valid_to": entry.valid_to
+        }
+
+    history = query.order_by(ProductPriceHistory.valid_from).all()
+    return [{
+        "price": h.price,
+        "valid_from": h.valid_from,
+        "valid_to": h.valid_to
+    } for h in history]
+
 @app.delete("/products/{product_id}")
 def delete_product(product_id: int, session: Session = Depends(get_db)):
     product = session.query(Product).filter(Product.id == product_id).first()
     if product is None:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    adjust_category_aggregates(session, product.category_id, -1, -product.price * product.quantity)
+    session.add(ProductDeletion(
+        product_id=product.id,
+        version=bump_catalog_version(session)
+    ))
     session.delete(product)
     session.commit()
     return {"message": "Product deleted successfully"}
@@ -352,15 +711,15 @@ def get_order(order_id: int, session: Session = Depends(get_db)):
     if order is None:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Get order items
+    # Get order items with the price and name captured at purchase time
     order_items = session.query(
         OrderItems.id,
         OrderItems.product_id,
+        OrderItems.product_name,
         OrderItems.quantity,
-        OrderItems.subtotal,
-        Product.name.label("product_name"),
-        Product.price
-    ).join(Product, OrderItems.product_id == Product.id).filter(
+        OrderItems.unit_price,
+        OrderItems.subtotal
+    ).filter(
         OrderItems.order_id == order_id
     ).all()
     
@@ -375,7 +734,7 @@ def get_order(order_id: int, session: Session = Depends(get_db)):
             "product_id": item.product_id,
             "product_name": item.product_name,
             "quantity": item.quantity,
-            "price": item.price,
+            "price": item.unit_price,
             "subtotal": item.subtotal
         } for item in order_items]
     }
@@ -390,6 +749,7 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_db)):
     # Calculate total amount and validate stock
     total_amount = 0
     order_items_data = []
+    version = bump_catalog_version(session)
     
     for item in order_data.items:
         # Get product and check stock
@@ -409,13 +769,16 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_db)):
         
         # Reduce product quantity
         product.quantity -= item.quantity
+        product.version = version
+        adjust_category_aggregates(session, product.category_id, 0, -subtotal)
         
         # Prepare order item data
         order_items_data.append({
             "product_id": item.product_id,
+            "product_name": product.name,
             "quantity": item.quantity,
-            "subtotal": subtotal,
-            "product": product
+            "unit_price": product.price,
+            "subtotal": subtotal
         })
     
     # Create order
@@ -431,7 +794,9 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_db)):
         order_item = OrderItems(
             order_id=new_order.id,
             product_id=item_data["product_id"],
+            product_name=item_data["product_name"],
             quantity=item_data["quantity"],
+            unit_price=item_data["unit_price"],
             subtotal=item_data["subtotal"]
         )
         session.add(order_item)
@@ -445,6 +810,26 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_db)):
         "total_amount": total_amount
     }
 
+# ============ MAINTENANCE ENDPOINTS ============
+def purge_stale_snapshots():
+    # drop cached snapshot bodies once the catalog has moved past them
+    session = SessionLocal()
+    try:
+        version = get_catalog_version(session)
+    finally:
+        session.close()
+    with _snapshot_cache_lock:
+        if _snapshot_cache["version"] != version:
+            _snapshot_cache["version"] = None
+            _snapshot_cache["bodies"] = {}
+
+scheduler.register("purge_stale_snapshots", purge_stale_snapshots, interval=10 * 60, jitter=60)
+scheduler.register("purge_rate_limit_buckets", rate_limiter.purge, interval=60, jitter=10)
+
+@app.get("/maintenance/jobs")
+def get_maintenance_jobs():
+    return scheduler.metrics()
+
 @app.get("/")
 def index():
     return {"name": "StockWise API", "version": "1.0.0"}
@@ -0,0 +1,61 @@
+"""order price snapshots and price history
+
+Revision ID: 3b7c1e2a9d41
+Revises: 06443034d895
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7c1e2a9d41'
+down_revision: Union[str, None] = '06443034d895'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('product_price_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Integer(), nullable=False),
+    sa.Column('valid_from', sa.DateTime(), nullable=False),
+    sa.Column('valid_to', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_product_price_history_product_id_valid_from', 'product_price_history', ['product_id', 'valid_from'], unique=False)
+
+    with op.batch_alter_table('order_items') as batch_op:
+        batch_op.add_column(sa.Column('unit_price', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('product_name', sa.Text(), nullable=True))
+
+    # Backfill existing rows: the unit price is recoverable from the stored
+    # subtotal, the name can only come from the current product row
+    op.execute(
+        "UPDATE order_items SET "
+        "unit_price = subtotal / quantity, "
+        "product_name = (SELECT product.name FROM product WHERE product.id = order_items.product_id)"
+    )
+    # The app stamps history with naive local datetime.now(), so seed with
+    # local time too (CURRENT_TIMESTAMP is UTC)
+    op.execute(
+        "INSERT INTO product_price_history (product_id, price, valid_from) "
+        "SELECT id, price, datetime('now', 'localtime') FROM product"
+    )
+
+    with op.batch_alter_table('order_items') as batch_op:
+        batch_op.alter_column('unit_price', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('product_name', existing_type=sa.Text(), nullable=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('order_items') as batch_op:
+        batch_op.drop_column('product_name')
+        batch_op.drop_column('unit_price')
+    op.drop_index('ix_product_price_history_product_id_valid_from', table_name='product_price_history')
+    op.drop_table('product_price_history')
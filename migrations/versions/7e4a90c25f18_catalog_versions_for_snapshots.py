@@ -0,0 +1,48 @@
+"""catalog versions for snapshots
+
+Revision ID: 7e4a90c25f18
+Revises: 3b7c1e2a9d41
+Create Date: 2026-10-19 10:02:17.540391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e4a90c25f18'
+down_revision: Union[str, None] = '3b7c1e2a9d41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0)")
+
+    op.create_table('product_deletion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_product_deletion_version'), 'product_deletion', ['version'], unique=False)
+
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index(batch_op.f('ix_product_version'), ['version'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_version'))
+        batch_op.drop_column('version')
+    op.drop_index(op.f('ix_product_deletion_version'), table_name='product_deletion')
+    op.drop_table('product_deletion')
+    op.drop_table('catalog_version')
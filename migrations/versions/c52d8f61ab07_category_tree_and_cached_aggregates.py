@@ -0,0 +1,63 @@
+"""category tree and cached aggregates
+
+Revision ID: c52d8f61ab07
+Revises: 7e4a90c25f18
+Create Date: 2026-10-19 11:26:53.902147
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52d8f61ab07'
+down_revision: Union[str, None] = '7e4a90c25f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('path', sa.Text(), nullable=False, server_default='/'))
+        batch_op.add_column(sa.Column('product_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('stock_value', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('subtree_product_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('subtree_stock_value', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_foreign_key('fk_category_parent_id_category', 'category', ['parent_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_category_parent_id'), ['parent_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_category_path'), ['path'], unique=False)
+
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_category_id'), ['category_id'], unique=False)
+
+    # Existing categories are all roots, so subtree totals equal their own
+    op.execute(
+        "UPDATE category SET "
+        "path = '/' || id || '/', "
+        "product_count = (SELECT COUNT(*) FROM product WHERE product.category_id = category.id), "
+        "stock_value = (SELECT COALESCE(SUM(price * quantity), 0) FROM product WHERE product.category_id = category.id)"
+    )
+    op.execute(
+        "UPDATE category SET "
+        "subtree_product_count = product_count, "
+        "subtree_stock_value = stock_value"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_category_id'))
+
+    with op.batch_alter_table('category') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_category_path'))
+        batch_op.drop_index(batch_op.f('ix_category_parent_id'))
+        batch_op.drop_constraint('fk_category_parent_id_category', type_='foreignkey')
+        batch_op.drop_column('subtree_stock_value')
+        batch_op.drop_column('subtree_product_count')
+        batch_op.drop_column('stock_value')
+        batch_op.drop_column('product_count')
+        batch_op.drop_column('path')
+        batch_op.drop_column('parent_id')
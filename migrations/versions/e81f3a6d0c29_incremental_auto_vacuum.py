@@ -0,0 +1,34 @@
+"""incremental auto vacuum
+
+Revision ID: e81f3a6d0c29
+Revises: c52d8f61ab07
+Create Date: 2026-10-19 14:41:05.327816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81f3a6d0c29'
+down_revision: Union[str, None] = 'c52d8f61ab07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # auto_vacuum can only be switched on an existing file by rebuilding it,
+    # and VACUUM cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        op.execute("VACUUM")
+        op.execute("PRAGMA journal_mode=WAL")
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("PRAGMA journal_mode=DELETE")
+        op.execute("PRAGMA auto_vacuum=NONE")
+        op.execute("VACUUM")
@@ -1,12 +1,22 @@
 # import the necessary packages
 from datetime import datetime
-from sqlalchemy import Column, Integer, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Text, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 
 # create an engine which essentially is responsible for converting sql to python and vicevercer
 engine = create_engine("sqlite:///stockwise.db", echo=True)
 
+# WAL lets reads run alongside writes and is checkpointed by the scheduler;
+# incremental auto_vacuum only takes effect on a new file (existing ones are
+# converted by a migration) and lets the scheduler hand free pages back
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 # create session which allows us to interface with the db
 
 Session = sessionmaker(bind=engine)
@@ -56,9 +66,22 @@ class Category(Base):
     id = Column(Integer(), primary_key=True)
     name = Column(Text(), nullable=False)
     description = Column(Text())
+    parent_id = Column(Integer(), ForeignKey("category.id"), index=True)
+    # materialized path of ids from the root, e.g. "/1/4/", so a subtree is
+    # an index range scan on the path prefix
+    path = Column(Text(), nullable=False, default="/", index=True)
+
+    # cached aggregates kept up to date by the product and order endpoints,
+    # for this category alone and for its whole subtree
+    product_count = Column(Integer(), nullable=False, default=0)
+    stock_value = Column(Integer(), nullable=False, default=0)
+    subtree_product_count = Column(Integer(), nullable=False, default=0)
+    subtree_stock_value = Column(Integer(), nullable=False, default=0)
 
         # relationship category has many products
     products = relationship("Product", back_populates="category")
+    parent = relationship("Category", remote_side=[id], back_populates="children")
+    children = relationship("Category", back_populates="parent")
 
         # ------------------
         #   PRODUCT MODEL
@@ -71,12 +94,60 @@ class Product(Base):
     name = Column(Text(), nullable=False)
     price = Column(Integer(), nullable=False)
     quantity = Column(Integer(), nullable=False)
-    category_id = Column(Integer(), ForeignKey("category.id"), nullable=False)
+    category_id = Column(Integer(), ForeignKey("category.id"), nullable=False, index=True)
+    # catalog version of the last write touching this row, for delta snapshots
+    version = Column(Integer(), nullable=False, default=0, index=True)
 
             # relationship
 
     category = relationship("Category", back_populates = "products")
     orders_items = relationship("OrderItems", back_populates="product")
+    price_history = relationship("ProductPriceHistory", back_populates="product", cascade="all, delete-orphan")
+
+            # --------------------------
+            #   PRODUCT PRICE HISTORY MODEL
+            # --------------------------
+
+class ProductPriceHistory(Base):
+    __tablename__ = "product_price_history"
+
+    id = Column(Integer(), primary_key=True)
+    product_id = Column(Integer(), ForeignKey("product.id"), nullable=False)
+    price = Column(Integer(), nullable=False)
+    valid_from = Column(DateTime, nullable=False, default=datetime.now)
+    # null valid_to means this is the current price
+    valid_to = Column(DateTime)
+
+    # point-in-time lookups: latest valid_from <= t for a product
+    __table_args__ = (
+        Index("ix_product_price_history_product_id_valid_from", "product_id", "valid_from"),
+    )
+
+            # relationship
+    product = relationship("Product", back_populates="price_history")
+
+            # ------------------------
+            #   CATALOG VERSION MODEL
+            # ------------------------
+
+class CatalogVersion(Base):
+    # single row counter bumped on every catalog write
+    __tablename__ = "catalog_version"
+
+    id = Column(Integer(), primary_key=True)
+    version = Column(Integer(), nullable=False, default=0)
+
+            # ------------------------
+            #   PRODUCT DELETION MODEL
+            # ------------------------
+
+class ProductDeletion(Base):
+    # tombstones so delta snapshots can report removed products
+    __tablename__ = "product_deletion"
+
+    id = Column(Integer(), primary_key=True)
+    product_id = Column(Integer(), nullable=False)
+    version = Column(Integer(), nullable=False, index=True)
 
             # ------------------
             #   ORDERS MODEL
@@ -106,6 +177,9 @@ class OrderItems(Base):
     product_id = Column(Integer(), ForeignKey("product.id"), nullable=False)
     order_id = Column(Integer(), ForeignKey("orders.id"), nullable=False)
     quantity = Column(Integer(), nullable=False)
+    # price and name captured when the order was placed
+    unit_price = Column(Integer(), nullable=False)
+    product_name = Column(Text(), nullable=False)
     subtotal = Column(Integer(), nullable=False)
 
     # relationship
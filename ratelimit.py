@@ -0,0 +1,171 @@
+# per-client rate limiting and admission control for expensive endpoints
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Token buckets per client plus a cap on in-flight heavy requests.
+
+    Requests update buckets on the event loop while purge() runs on a
+    scheduler thread, so bucket access goes through self.lock. in_flight
+    is only touched on the event loop.
+    """
+
+    def __init__(self, rate=10.0, burst=30.0, route_costs=None, heavy_cost=5,
+                 max_heavy_in_flight=4, busy_retry_after=1, max_buckets=10000,
+                 api_keys=()):
+        self.rate = rate
+        self.burst = burst
+        self.route_costs = route_costs or {}
+        # only these keys get their own bucket, anything else is keyed by IP
+        self.api_keys = {key.encode() if isinstance(key, str) else key for key in api_keys}
+        self.heavy_cost = heavy_cost
+        self.max_heavy_in_flight = max_heavy_in_flight
+        self.busy_retry_after = busy_retry_after
+        self.max_buckets = max_buckets
+        self.in_flight = 0
+        # client key -> [tokens, last update], least recently used first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cost(self, method, path):
+        return min(self.route_costs.get((method, path), 1), self.burst)
+
+    def acquire(self, key, cost, now):
+        """Take cost tokens from the client's bucket; returns 0 or the seconds to wait."""
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.max_buckets:
+                    # evict the least recently used client to stay bounded
+                    self.buckets.popitem(last=False)
+                bucket = self.buckets[key] = [self.burst, now]
+            else:
+                self.buckets.move_to_end(key)
+
+            tokens = bucket[0] + (now - bucket[1]) * self.rate
+            if tokens > self.burst:
+                tokens = self.burst
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return 0.0
+            bucket[0] = tokens
+            return (cost - tokens) / self.rate
+
+    def purge(self, now=None):
+        """Drop buckets that have refilled completely; they are the same as a new bucket."""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            snapshot = list(self.buckets.items())
+
+        def is_full(bucket):
+            return bucket[0] + (now - bucket[1]) * self.rate >= self.burst
+
+        removed = 0
+        for key, bucket in snapshot:
+            if not is_full(bucket):
+                continue
+            # recheck under the lock, a request may have drained it since
+            with self.lock:
+                current = self.buckets.get(key)
+                if current is not None and is_full(current):
+                    del self.buckets[key]
+                    removed += 1
+        return removed
+
+
+def client_key(scope, api_keys):
+    # prefer a known API key of an integration, fall back to the client
+    # address so made-up keys cannot mint fresh buckets
+    for name, value in scope["headers"]:
+        if name == b"x-api-key":
+            if value in api_keys:
+                return value
+            break
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+async def reject(send, status, detail, retry_after):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 over the rate limit and 503 when heavy routes are saturated."""
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        cost = limiter.cost(scope["method"], scope["path"])
+        heavy = cost >= limiter.heavy_cost
+
+        # admission first, so a 503 does not cost the client any tokens
+        if heavy and limiter.in_flight >= limiter.max_heavy_in_flight:
+            await reject(send, 503, "Server busy, try again shortly", limiter.busy_retry_after)
+            return
+
+        wait = limiter.acquire(client_key(scope, limiter.api_keys), cost, time.monotonic())
+        if wait:
+            await reject(send, 429, "Too many requests", wait)
+            return
+
+        if not heavy:
+            await self.app(scope, receive, send)
+            return
+
+        limiter.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.in_flight -= 1
+
+
+if __name__ == "__main__":
+    # micro benchmark: time added per request on the allowed path
+    import asyncio
+
+    async def noop_app(scope, receive, send):
+        pass
+
+    async def bench(app, scopes):
+        started = time.perf_counter()
+        for scope in scopes:
+            await app(scope, None, None)
+        return time.perf_counter() - started
+
+    n = 200000
+    limiter = RateLimiter(rate=1e9, burst=1e9, route_costs={("GET", "/orders"): 10})
+    middleware = RateLimitMiddleware(noop_app, limiter)
+    scopes = [{
+        "type": "http",
+        "method": "GET",
+        "path": "/orders" if i % 2 else "/products/1",
+        "headers": [(b"host", b"localhost"), (b"accept", b"*/*")],
+        "client": (f"10.0.{i % 250}.{i % 200}", 50000),
+    } for i in range(n)]
+
+    baseline = asyncio.run(bench(noop_app, scopes))
+    limited = asyncio.run(bench(middleware, scopes))
+    print(f"{len(limiter.buckets)} buckets, {(limited - baseline) / n * 1e6:.2f}us added per request")
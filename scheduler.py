@@ -0,0 +1,172 @@
+# in-process scheduler for periodic maintenance jobs
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import text
+from models import engine, Base
+
+logger = logging.getLogger("stockwise.scheduler")
+
+
+class Job:
+    def __init__(self, name, func, interval, jitter=0.0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        # single flight: a run is skipped while the previous one is still going
+        self.lock = threading.Lock()
+        self.next_run = 0.0
+
+        # run-time metrics
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started_at = None
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_error = None
+        # whatever the job function returned on its last successful run
+        self.last_result = None
+
+    def schedule_next(self, now):
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+    def metrics(self):
+        return {
+            "name": self.name,
+            "interval": self.interval,
+            "running": self.lock.locked(),
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started_at": self.last_started_at,
+            "last_duration": self.last_duration,
+            "avg_duration": self.total_duration / self.runs if self.runs else None,
+            "max_duration": self.max_duration,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+        }
+
+
+class Scheduler:
+    """Runs registered jobs on a thread pool so they never block request handling."""
+
+    def __init__(self, max_workers=2, tick=1.0):
+        self.jobs = {}
+        self.max_workers = max_workers
+        self.tick = tick
+        self._executor = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def register(self, name, func, interval, jitter=0.0):
+        job = Job(name, func, interval, jitter)
+        self.jobs[name] = job
+        return job
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="maintenance")
+        now = time.monotonic()
+        for job in self.jobs.values():
+            job.schedule_next(now)
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def metrics(self):
+        return [job.metrics() for job in self.jobs.values()]
+
+    def _loop(self):
+        while not self._stop.wait(self.tick):
+            now = time.monotonic()
+            for job in self.jobs.values():
+                if job.next_run > now:
+                    continue
+                job.schedule_next(now)
+                if not job.lock.acquire(blocking=False):
+                    job.skipped += 1
+                    continue
+                self._executor.submit(self._run, job)
+
+    def _run(self, job):
+        # the caller holds job.lock, released here once the run is recorded
+        try:
+            job.last_started_at = datetime.now()
+            started = time.perf_counter()
+            try:
+                job.last_result = job.func()
+            except Exception as exc:
+                job.failures += 1
+                job.last_error = repr(exc)
+                logger.exception("Maintenance job %s failed", job.name)
+            duration = time.perf_counter() - started
+            job.runs += 1
+            job.last_duration = duration
+            job.total_duration += duration
+            job.max_duration = max(job.max_duration, duration)
+        finally:
+            job.lock.release()
+
+
+# ============ MAINTENANCE JOBS ============
+
+def optimize_database():
+    # refreshes planner statistics and hands free pages back to the OS
+    # (the database runs with auto_vacuum=INCREMENTAL, see models.py)
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA optimize"))
+        freelist_before = conn.execute(text("PRAGMA freelist_count")).scalar()
+        conn.commit()
+
+        # incremental_vacuum frees one page per step, and sqlite3's execute()
+        # steps a statement without result columns only once (fetchall()
+        # doesn't help); executescript() runs it to completion
+        conn.connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+
+        freelist_after = conn.execute(text("PRAGMA freelist_count")).scalar()
+    return {"freelist_before": freelist_before, "freelist_after": freelist_after}
+
+def checkpoint_wal():
+    # folds the WAL back into the main file and truncates it
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+def check_index_health():
+    # every index declared on the models should exist and pass a quick check
+    with engine.connect() as conn:
+        existing = set(conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index'")
+        ).scalars())
+        expected = {index.name for table in Base.metadata.tables.values() for index in table.indexes}
+        missing = sorted(expected - existing)
+        if missing:
+            logger.warning("Missing indexes: %s", ", ".join(missing))
+
+        problems = [row for row in conn.execute(text("PRAGMA quick_check")).scalars() if row != "ok"]
+        if problems:
+            logger.warning("quick_check reported: %s", "; ".join(problems))
+
+    if missing or problems:
+        raise RuntimeError(f"{len(missing)} missing indexes, {len(problems)} integrity problems")
+
+
+scheduler = Scheduler()
+scheduler.register("optimize_database", optimize_database, interval=6 * 60 * 60, jitter=10 * 60)
+scheduler.register("checkpoint_wal", checkpoint_wal, interval=5 * 60, jitter=30)
+scheduler.register("check_index_health", check_index_health, interval=24 * 60 * 60, jitter=30 * 60)